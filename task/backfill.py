@@ -0,0 +1,284 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import yaml
+import aiomysql
+import tracing
+from pages.main import OCRProcessor
+from pdfs.main import PDFTaskRunner
+from pdfs.pdf_processor import PDFProcessor
+
+logger = logging.getLogger('Backfill')
+
+
+class BackfillStats:
+    """单类任务的回填统计"""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def processed(self) -> int:
+        return self.succeeded + self.failed + self.skipped
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def record(self, result):
+        if result is None:
+            self.skipped += 1
+        elif result:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+
+    def report(self) -> str:
+        elapsed = self.elapsed
+        rate = self.succeeded / elapsed if elapsed > 0 else 0.0
+        return (
+            f"{self.kind}: 共 {self.processed} 条, 成功 {self.succeeded}, 失败 {self.failed}, "
+            f"跳过 {self.skipped}, 耗时 {elapsed:.1f}s, 吞吐 {rate:.2f} 条/秒"
+        )
+
+
+class BackfillRunner:
+    """一次性批量回填
+
+    按 id 范围或 document_id 列表处理存量页面和 PDF 任务：按配置的最大并发运行，
+    不做空闲等待；进度按 id 水位写入检查点文件，中断后可续跑；
+    与常驻任务共用页面锁和任务认领，不会重复处理。
+    """
+
+    KINDS = ('pages', 'pdfs')
+
+    def __init__(self, start_id: int = None, end_id: int = None, document_ids: list = None,
+                 checkpoint_path: str = None, kinds: tuple = KINDS, batch_size: int = 500,
+                 checkpoint_interval: float = 10):
+        config_path = os.path.join(os.path.dirname(__file__), 'config.yml')
+        with open(config_path, 'r', encoding='utf-8') as f:
+            self.config = yaml.safe_load(f)
+
+        self.db_config = self.config['database'].copy()
+        if 'database' in self.db_config:
+            self.db_config['db'] = self.db_config.pop('database')
+
+        self.start_id = start_id
+        self.end_id = end_id
+        self.document_ids = sorted(set(document_ids)) if document_ids else []
+        self.kinds = kinds
+        self.batch_size = batch_size
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_path = checkpoint_path or os.path.join(os.path.dirname(__file__), 'backfill.checkpoint.json')
+        self.page_concurrency = self.config.get('ocr', {}).get('max_concurrent', 4)
+        self.pdf_concurrency = self.config.get('pdf', {}).get('max_concurrent', 3)
+        self.checkpoint = self._load_checkpoint()
+        self._last_saved = time.monotonic()
+
+    def _scope(self) -> dict:
+        return {
+            'start_id': self.start_id,
+            'end_id': self.end_id,
+            'document_ids': self.document_ids,
+        }
+
+    def _load_checkpoint(self) -> dict:
+        """读取检查点，回填范围不一致时忽略旧进度"""
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('scope') != self._scope():
+            logger.warning(f"检查点 {self.checkpoint_path} 的回填范围与本次不一致，从头开始")
+            return {}
+        logger.info(f"从检查点续跑: {checkpoint.get('cursor')}")
+        return checkpoint.get('cursor', {})
+
+    def _save_checkpoint(self):
+        """原子写入检查点文件"""
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'scope': self._scope(), 'cursor': self.checkpoint}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+        self._last_saved = time.monotonic()
+
+    def _filters(self, id_column: str, document_column: str = None):
+        """构造 id 范围和 document_id 过滤条件"""
+        sql, args = [], []
+        if self.end_id is not None:
+            sql.append(f"AND {id_column} <= %s")
+            args.append(self.end_id)
+        if self.document_ids and document_column:
+            sql.append(f"AND {document_column} IN ({', '.join(['%s'] * len(self.document_ids))})")
+            args.extend(self.document_ids)
+        return ' '.join(sql), args
+
+    async def _fetch_pages(self, pool, after_id: int, extra_filter: str = "") -> list:
+        """按 id 顺序分批获取范围内未识别的页面"""
+        filters, args = self._filters('id', 'document_id')
+        filters += extra_filter
+        async with pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(
+                    f"SELECT id, image_path FROM ww_document_pages "
+                    f"WHERE content IS NULL AND deleted_at IS NULL AND id > %s {filters} "
+                    f"ORDER BY id ASC LIMIT %s",
+                    (after_id, *args, self.batch_size)
+                )
+                result = await cursor.fetchall()
+            await conn.commit()
+        return result
+
+    async def _fetch_pdfs(self, pool, after_id: int) -> list:
+        """按 id 顺序分批获取范围内待处理的 PDF 任务"""
+        filters, args = self._filters('t.id', 'f.document_id')
+        join = "JOIN ww_pdf_file f ON f.id = t.id " if self.document_ids else ""
+        async with pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(
+                    f"SELECT t.* FROM ww_pdf_task t {join}"
+                    f"WHERE t.status = 'pending' AND t.id > %s {filters} "
+                    f"ORDER BY t.id ASC LIMIT %s",
+                    (after_id, *args, self.batch_size)
+                )
+                result = await cursor.fetchall()
+            await conn.commit()
+        return result
+
+    async def _fetch_with_retry(self, kind: str, fetch, after_id: int, retries: int = 3) -> list:
+        """拉取一批记录，数据库临时出错时重试"""
+        for attempt in range(1, retries + 1):
+            try:
+                return await fetch(after_id)
+            except Exception as e:
+                if attempt >= retries:
+                    raise
+                logger.warning(f"拉取{kind}失败 ({attempt}/{retries}): {str(e)}")
+                await asyncio.sleep(5 * attempt)
+
+    async def _drain(self, kind: str, fetch, handle, concurrency: int, prefetcher=None) -> BackfillStats:
+        """生产者分批拉取记录，concurrency 个工作协程并发处理，
+        传入 prefetcher 时生产者先预读页面图片再交给工作协程
+
+        检查点记录的是水位：不大于它的 id 都已处理过（成功、失败或跳过），
+        失败的记录留给常驻任务重试。
+        """
+        stats = BackfillStats(kind)
+        queue = asyncio.Queue(maxsize=concurrency * 2)
+        in_flight = set()
+        last_fetched = self.checkpoint.get(kind, (self.start_id or 1) - 1)
+
+        def watermark():
+            return min(in_flight) - 1 if in_flight else last_fetched
+
+        async def producer():
+            nonlocal last_fetched
+            while True:
+                rows = await self._fetch_with_retry(kind, fetch, last_fetched)
+                if not rows:
+                    break
+                in_flight.update(row['id'] for row in rows)
+                if prefetcher:
+                    async for row, data, size in prefetcher.iterate(rows):
+                        await queue.put((row, data, size))
+                        last_fetched = row['id']
+                else:
+                    for row in rows:
+                        await queue.put((row, None, 0))
+                        last_fetched = row['id']
+            for _ in range(concurrency):
+                await queue.put(None)
+
+        async def worker():
+            while True:
+                entry = await queue.get()
+                if entry is None:
+                    return
+                row, data, size = entry
+                try:
+                    result = await handle(row, data)
+                except Exception as e:
+                    logger.error(f"{kind} {row['id']} 处理失败: {str(e)}")
+                    result = False
+                finally:
+                    if prefetcher:
+                        await prefetcher.release(size)
+                stats.record(result)
+                in_flight.discard(row['id'])
+                if time.monotonic() - self._last_saved >= self.checkpoint_interval:
+                    self.checkpoint[kind] = watermark()
+                    self._save_checkpoint()
+                    logger.info(f"回填进度 {stats.report()}")
+
+        tasks = [asyncio.create_task(producer())]
+        tasks.extend(asyncio.create_task(worker()) for _ in range(concurrency))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # 出错或被中断时先停下所有协程，再写检查点、关闭连接池
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.checkpoint[kind] = watermark()
+            self._save_checkpoint()
+            stats.finished_at = time.monotonic()
+        return stats
+
+    async def backfill_pages(self) -> BackfillStats:
+        """回填页面 OCR"""
+        processor = OCRProcessor()
+        # 每个处理中的页面占用一个锁连接和一个写入连接
+        pool = await aiomysql.create_pool(maxsize=self.page_concurrency * 2 + 1, **self.db_config)
+        try:
+            return await self._drain(
+                'pages',
+                lambda after_id: self._fetch_pages(pool, after_id, processor.pending_filter()),
+                lambda page, image_data: processor.process_page_async(pool, page, image_data),
+                self.page_concurrency,
+                processor.create_prefetcher()
+            )
+        finally:
+            pool.close()
+            await pool.wait_closed()
+
+    async def backfill_pdfs(self) -> BackfillStats:
+        """回填 PDF 任务"""
+        runner = PDFTaskRunner()
+        pool = await aiomysql.create_pool(maxsize=self.pdf_concurrency * 2 + 1, **self.db_config)
+        processor = PDFProcessor(pool)
+        try:
+            return await self._drain(
+                'pdfs',
+                lambda after_id: self._fetch_pdfs(pool, after_id),
+                lambda task, _: runner._process_task(processor, task),
+                self.pdf_concurrency
+            )
+        finally:
+            await processor.close()
+
+    async def run(self) -> list:
+        """运行回填并打印吞吐报告"""
+        diagnostics = tracing.install()
+        jobs = []
+        if 'pages' in self.kinds:
+            jobs.append(self.backfill_pages())
+        if 'pdfs' in self.kinds:
+            jobs.append(self.backfill_pdfs())
+        try:
+            results = await asyncio.gather(*jobs)
+        finally:
+            for task in diagnostics:
+                task.cancel()
+            tracing.get_tracer().close()
+
+        print("回填完成")
+        for stats in results:
+            print(stats.report())
+        return results
@@ -1,6 +1,9 @@
+import argparse
 import asyncio
 from pages.main import OCRProcessor
 from pdfs.main import PDFTaskRunner
+from backfill import BackfillRunner
+import tracing
 import yaml
 import os
 from dotenv import load_dotenv
@@ -57,13 +60,44 @@ class TaskManager:
 
     async def run(self):
         """运行所有任务"""
+        self.diagnostics = tracing.install()
         tasks = [
             self.process_pages(),
             self.process_pdfs()
         ]
         await asyncio.gather(*tasks)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="文档处理任务")
+    subparsers = parser.add_subparsers(dest='command')
+
+    backfill = subparsers.add_parser('backfill', help="一次性批量回填存量页面和PDF任务")
+    # 页面和PDF任务的 id 是两套序列，同一个范围会同时作用于两者
+    backfill.add_argument('--start-id', type=int,
+                          help="起始 id（含），同时过滤页面 id 和PDF任务 id，通常配合 --only 使用")
+    backfill.add_argument('--end-id', type=int,
+                          help="结束 id（含），同时过滤页面 id 和PDF任务 id，通常配合 --only 使用")
+    backfill.add_argument('--document-ids', type=lambda s: [int(i) for i in s.split(',') if i],
+                          help="只处理这些文档，逗号分隔")
+    backfill.add_argument('--only', choices=BackfillRunner.KINDS, help="只回填页面或PDF")
+    backfill.add_argument('--checkpoint', help="检查点文件路径，中断后用同一文件续跑")
+    backfill.add_argument('--batch-size', type=int, default=500, help="每次从数据库拉取的记录数")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    if args.command == 'backfill':
+        runner = BackfillRunner(
+            start_id=args.start_id,
+            end_id=args.end_id,
+            document_ids=args.document_ids,
+            checkpoint_path=args.checkpoint,
+            kinds=(args.only,) if args.only else BackfillRunner.KINDS,
+            batch_size=args.batch_size
+        )
+        asyncio.run(runner.run())
+        return
+
     manager = TaskManager()
     asyncio.run(manager.run())
 
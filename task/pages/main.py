@@ -2,12 +2,29 @@ import asyncio
 import base64
 import os
 import yaml
-from typing import List, Dict
+from contextlib import asynccontextmanager
+from typing import List, Dict, Optional
 
 # 在文件开头添加
 import aiohttp
 import aiomysql
 import json
+from tracing import bind, span
+from .prefetch import ImagePrefetcher
+
+# 文档的PDF任务尚未结束时，页面留给PDF识别结果回填，不单独识别；
+# 处理中/下载中的任务超过 30 分钟没有更新（与 reset_stale_tasks 的超时一致）视为卡住，不再等待
+PDF_IN_PROGRESS_FILTER = """
+    AND NOT EXISTS (
+        SELECT 1 FROM ww_pdf_file f 
+        JOIN ww_pdf_task t ON t.id = f.id 
+        WHERE f.document_id = ww_document_pages.document_id 
+        AND (
+            t.status = 'pending' 
+            OR (t.status IN ('processing', 'downloading') AND t.updated_at > NOW() - INTERVAL 30 MINUTE)
+        )
+    )
+"""
 
 class OCRProcessor:
     def __init__(self):
@@ -24,29 +41,75 @@ class OCRProcessor:
         self.headers = {
             'Content-Type': 'application/json'
         }
+        self.prefetch_config = self.config['ocr'].get('prefetch', {})
+        self.defer_to_pdf = self.config.get('pdf', {}).get('fill_pages', True)
+
+    def pending_filter(self) -> str:
+        """未识别页面的附加过滤条件"""
+        return PDF_IN_PROGRESS_FILTER if self.defer_to_pdf else ""
+
+    def create_prefetcher(self) -> ImagePrefetcher:
+        """创建页面图片预读器"""
+        return ImagePrefetcher(
+            lambda page: self.config['app']['resource_path'] + page['image_path'],
+            depth=self.prefetch_config.get('depth', 4),
+            max_bytes=self.prefetch_config.get('max_mb', 64) * 1024 * 1024,
+            fadvise=self.prefetch_config.get('fadvise', True),
+            key_of=lambda page: page['id']
+        )
 
-    async def get_unprocessed_pages_async(self) -> List[Dict]:
+    async def get_unprocessed_pages_async(self, pool) -> List[Dict]:
         """异步获取未处理的页面记录"""
-        pool = await aiomysql.create_pool(**self.db_config)
-        async with pool.acquire() as conn:
-            async with conn.cursor(aiomysql.DictCursor) as cursor:
-                await cursor.execute("""
-                    SELECT id, image_path 
-                    FROM ww_document_pages 
-                    WHERE content IS NULL 
-                    AND deleted_at IS NULL
-                """)
-                result = await cursor.fetchall()
-        pool.close()
-        await pool.wait_closed()
+        with span('db_fetch', kind='page'):
+            async with pool.acquire() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    await cursor.execute("""
+                        SELECT id, image_path 
+                        FROM ww_document_pages 
+                        WHERE content IS NULL 
+                        AND deleted_at IS NULL
+                    """ + self.pending_filter())
+                    result = await cursor.fetchall()
         return result
 
-    async def process_image_async(self, image_path: str) -> str:
-        """异步处理单个图片的OCR识别"""
+    @asynccontextmanager
+    async def claim_page_async(self, pool, page_id: int):
+        """获取页面的独占处理权，避免常驻任务与回填任务重复识别同一页面
+
+        使用 MySQL 命名锁，锁随连接持有，处理结束后释放；
+        拿到锁后再次确认页面仍未识别，返回是否可以处理。
+        """
+        lock_name = f"ocr-task:page:{page_id}"
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                with span('claim'):
+                    await cursor.execute("SELECT GET_LOCK(%s, 0)", (lock_name,))
+                    (locked,) = await cursor.fetchone()
+                if locked != 1:
+                    yield False
+                    return
+                try:
+                    await cursor.execute("""
+                        SELECT content IS NULL 
+                        FROM ww_document_pages 
+                        WHERE id = %s
+                    """, (page_id,))
+                    row = await cursor.fetchone()
+                    await conn.commit()
+                    yield bool(row and row[0])
+                finally:
+                    await cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+                    await conn.commit()
+
+    async def process_image_async(self, image_path: str, image_data: Optional[bytes] = None) -> str:
+        """异步处理单个图片的OCR识别，image_data 为预读好的图片内容"""
         try:
             # 读取图片文件并转换为base64
-            with open(image_path, 'rb') as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+            if image_data is None:
+                with span('file_read'), open(image_path, 'rb') as image_file:
+                    image_data = image_file.read()
+            with span('base64_encode', bytes=len(image_data)):
+                base64_image = base64.b64encode(image_data).decode('utf-8')
 
             payload = {
                 "base64": base64_image,
@@ -60,8 +123,9 @@ class OCRProcessor:
             }
 
             async with aiohttp.ClientSession() as session:
-                async with session.post(self.ocr_url, headers=self.headers, json=payload) as response:
-                    response_text = await response.text()
+                with span('ocr_request'):
+                    async with session.post(self.ocr_url, headers=self.headers, json=payload) as response:
+                        response_text = await response.text()
                     if response.status == 200:
                         try:
                             res = json.loads(response_text)
@@ -77,38 +141,59 @@ class OCRProcessor:
             print(f"处理图片失败: {str(e)}")
             return None
 
-    async def update_page_content_async(self, page_id: int, content: str):
+    async def update_page_content_async(self, pool, page_id: int, content: str):
         """异步更新页面内容"""
-        pool = await aiomysql.create_pool(**self.db_config)
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute("""
-                    UPDATE ww_document_pages 
-                    SET content = %s 
-                    WHERE id = %s
-                """, (content, page_id))
-                await conn.commit()
-        pool.close()
-        await pool.wait_closed()
+        with span('db_write'):
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("""
+                        UPDATE ww_document_pages 
+                        SET content = %s 
+                        WHERE id = %s
+                    """, (content, page_id))
+                    await conn.commit()
+
+    async def process_page_async(self, pool, page: Dict, image_data: Optional[bytes] = None) -> Optional[bool]:
+        """识别单个页面并回写内容，页面已被其他进程处理时返回 None"""
+        with bind(kind='page', task_id=page['id']), span('page'):
+            async with self.claim_page_async(pool, page['id']) as claimed:
+                if not claimed:
+                    return None
+                content = await self.process_image_async(
+                    self.config['app']['resource_path'] + page['image_path'], image_data
+                )
+                if not content:
+                    return False
+                await self.update_page_content_async(pool, page['id'], content)
+                return True
 
     async def run_async(self):
         """异步运行任务处理器"""
-        pages = await self.get_unprocessed_pages_async()
-        
+        pool = await aiomysql.create_pool(**self.db_config)
+        try:
+            pages = await self.get_unprocessed_pages_async(pool)
+            prefetcher = self.create_prefetcher()
+
+            async for page, image_data, size in prefetcher.iterate(pages):
+                print(f"处理页面 ID: {page['id']}")
+                try:
+                    result = await self.process_page_async(pool, page, image_data)
+                finally:
+                    await prefetcher.release(size)
+
+                if result:
+                    print(f"页面 {page['id']} 处理完成")
+                elif result is None:
+                    print(f"页面 {page['id']} 已由其他进程处理，跳过")
+
+                await asyncio.sleep(self.config['task']['request_interval'])
+        finally:
+            pool.close()
+            await pool.wait_closed()
+
         if not pages:
             print(f"没有需要处理的页面，等待{self.config['task']['wait_time']}秒...")
             await asyncio.sleep(self.config['task']['wait_time'])
-            return
-
-        for page in pages:
-            print(f"处理页面 ID: {page['id']}")
-            content = await self.process_image_async(self.config['app']['resource_path'] + page['image_path'])
-            
-            if content:
-                await self.update_page_content_async(page['id'], content)
-                print(f"页面 {page['id']} 处理完成")
-            
-            await asyncio.sleep(self.config['task']['request_interval'])
 
 if __name__ == "__main__":
     processor = OCRProcessor()
@@ -0,0 +1,118 @@
+import asyncio
+import os
+from tracing import bind, span
+from typing import AsyncIterator, Callable, Iterable, Optional, Tuple
+
+
+class ImagePrefetcher:
+    """页面图片预读
+
+    在前面的页面做 OCR 的同时，提前并发读取后面 depth 张图片到内存，
+    让存储延迟与 OCR 耗时重叠。已读取但未释放的字节数不超过 max_bytes
+    （单张图片超过上限时仍允许读取，保证不会卡死）。
+    """
+
+    def __init__(self, path_of: Callable, depth: int = 4, max_bytes: int = 64 * 1024 * 1024,
+                 fadvise: bool = True, key_of: Optional[Callable] = None):
+        self.path_of = path_of
+        self.key_of = key_of  # 取页面 id，用于追踪记录
+        self.depth = max(1, depth)
+        self.max_bytes = max_bytes
+        self.fadvise = fadvise and hasattr(os, 'posix_fadvise')
+        self.buffered = 0
+        self._budget = asyncio.Condition()
+
+    def _hint(self, path: str) -> int:
+        """获取文件大小，并提示内核提前读入页缓存"""
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if self.fadvise:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            return os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, 'rb') as f:
+            return f.read()
+
+    async def _reserve(self, size: int):
+        async with self._budget:
+            await self._budget.wait_for(lambda: self.buffered == 0 or self.buffered + size <= self.max_bytes)
+            self.buffered += size
+
+    async def release(self, size: int):
+        """使用方处理完一张图片后归还其占用的缓冲额度"""
+        if not size:
+            return
+        async with self._budget:
+            self.buffered -= size
+            self._budget.notify_all()
+
+    async def _load(self, path: str) -> Optional[bytes]:
+        try:
+            with span('file_read', prefetch=True):
+                return await asyncio.to_thread(self._read, path)
+        except OSError as e:
+            print(f"预读图片失败: {path} {str(e)}")
+            return None
+
+    async def iterate(self, items: Iterable) -> AsyncIterator[Tuple[object, Optional[bytes], int]]:
+        """按原顺序产出 (item, 图片内容, 占用额度)，读取失败时图片内容为 None
+
+        使用方处理完一张图片后需调用 release(占用额度)。
+        """
+        loads = asyncio.Queue(maxsize=self.depth)
+        # 已创建但还未放入队列的读取任务，调度被取消时由下面的 finally 取消并归还额度
+        scheduling = None
+
+        async def schedule():
+            nonlocal scheduling
+            try:
+                for item in items:
+                    try:
+                        path = self.path_of(item)
+                        size = await asyncio.to_thread(self._hint, path)
+                    except Exception as e:
+                        print(f"预读图片失败: {item} {str(e)}")
+                        await loads.put((item, None, 0))
+                        continue
+                    # 按顺序预留额度，避免后面的图片占满额度而前面的图片读不进来
+                    await self._reserve(size)
+                    # 读取任务创建时复制当前上下文，file_read 记录带上页面 id
+                    with bind(kind='page', task_id=self.key_of(item) if self.key_of else None):
+                        scheduling = (item, asyncio.create_task(self._load(path)), size)
+                    await loads.put(scheduling)
+                    scheduling = None
+            except Exception:
+                # 让使用方结束等待，并通过 await scheduler 拿到异常
+                await loads.put(None)
+                raise
+            await loads.put(None)
+
+        scheduler = asyncio.create_task(schedule())
+        entry = None
+        try:
+            while True:
+                entry = await loads.get()
+                if entry is None:
+                    break
+                item, load, size = entry
+                data = await load if load else None
+                entry = None
+                if data is None:
+                    await self.release(size)
+                    size = 0
+                yield item, data, size
+            await scheduler
+        finally:
+            # 提前退出时，取消尚未交给使用方的读取并归还额度
+            scheduler.cancel()
+            pending = [entry, scheduling]
+            while not loads.empty():
+                pending.append(loads.get_nowait())
+            for dropped in pending:
+                if dropped and dropped[1]:
+                    dropped[1].cancel()
+                    await self.release(dropped[2])
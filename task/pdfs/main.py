@@ -4,6 +4,7 @@ import logging
 import os
 import yaml
 import aiomysql
+from tracing import bind, span
 from .pdf_processor import PDFProcessor
 
 logging.basicConfig(
@@ -39,6 +40,20 @@ class PDFTaskRunner:
                 self.db_config['db'] = self.db_config.pop('database')
 
     async def _process_task(self, processor, task):
+        with bind(kind='pdf', task_id=task['id']), span('task'):
+            if not await processor.claim_task(task['id']):
+                logger.info(f"任务 {task['id']} 已被其他进程认领，跳过")
+                return None
+
+            try:
+                return await self._run_task(processor, task)
+            except asyncio.CancelledError:
+                # 被中断时归还本进程认领的任务，续跑或常驻任务可以接着处理
+                logger.info(f"任务 {task['id']} 被中断，重置为待处理")
+                await asyncio.shield(processor.update_status(task['id'], 'pending'))
+                raise
+
+    async def _run_task(self, processor, task):
         logger.info(f"开始处理任务 ID: {task['id']}")
         await processor._process_pending_task(task)
         
@@ -56,7 +71,9 @@ class PDFTaskRunner:
                         logger.info(f"任务 {task['id']} 处理完成")
                     return True
                 
-                await asyncio.sleep(5)
+                await processor.touch_task(task['id'])
+                with span('poll_wait'):
+                    await asyncio.sleep(5)
             except Exception as e:
                 retry_count += 1
                 logger.warning(f"任务 {task['id']} 处理出错 ({retry_count}/3): {str(e)}")
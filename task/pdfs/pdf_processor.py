@@ -5,6 +5,7 @@ import aiomysql
 import json
 import logging
 from pathlib import Path
+from tracing import span
 from .umi_ocr import UmiOcr
 
 logger = logging.getLogger('PDFProcessor')
@@ -23,19 +24,21 @@ class PDFProcessor:
         self.task_table = 'ww_pdf_task'
         self.task_page = 'ww_document_pages'
         self.semaphore = asyncio.Semaphore(self.config.get('pdf', {}).get('max_concurrent', 3))  # 并发控制
+        self.fill_pages_enabled = self.config.get('pdf', {}).get('fill_pages', True)  # 用PDF识别结果回填页面
         
     async def get_pending_tasks(self) -> list:
         """获取待处理任务"""
         try:
             async with self.pool.acquire() as conn:
                 async with conn.cursor(aiomysql.DictCursor) as cursor:
-                    await cursor.execute(
-                        f"SELECT * FROM {self.task_table} "
-                        f"WHERE status = 'pending' "
-                        f"ORDER BY id ASC "
-                        f"LIMIT 1 "
-                    )
-                    result = await cursor.fetchall()
+                    with span('db_fetch', kind='pdf'):
+                        await cursor.execute(
+                            f"SELECT * FROM {self.task_table} "
+                            f"WHERE status = 'pending' "
+                            f"ORDER BY id ASC "
+                            f"LIMIT 1 "
+                        )
+                        result = await cursor.fetchall()
             
             return result
         except Exception as e:
@@ -44,31 +47,35 @@ class PDFProcessor:
                 
     async def get_processing_task(self, task_id: int) -> dict:
         """获取处理中任务"""
-        async with self.pool.acquire() as conn:
-            async with conn.cursor(aiomysql.DictCursor) as cursor:
-                await cursor.execute(
-                    f"SELECT * FROM {self.task_table} WHERE id = %s AND status = 'processing' ",
-                    (task_id,)
-                )
-                return await cursor.fetchone()
+        with span('db_fetch'):
+            async with self.pool.acquire() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    await cursor.execute(
+                        f"SELECT * FROM {self.task_table} WHERE id = %s AND status = 'processing' ",
+                        (task_id,)
+                    )
+                    return await cursor.fetchone()
                 
     async def get_downloading_task(self, task_id: int) -> dict:
         """获取下载中任务"""
-        async with self.pool.acquire() as conn:
-            async with conn.cursor(aiomysql.DictCursor) as cursor:
-                await cursor.execute(
-                    f"SELECT * FROM {self.task_table} WHERE id = %s AND status = 'downloading' ",
-                    (task_id,)
-                )
-                return await cursor.fetchone()
+        with span('db_fetch'):
+            async with self.pool.acquire() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    await cursor.execute(
+                        f"SELECT * FROM {self.task_table} WHERE id = %s AND status = 'downloading' ",
+                        (task_id,)
+                    )
+                    return await cursor.fetchone()
                 
     async def _process_pending_task(self, task):
         """处理单个待处理任务"""
         async with self.semaphore:  # 使用信号量控制并发
             try:
                 logger.info(f"开始处理待处理任务 ID: {task['id']}")
-                await self.upload(task['id'])
-                await self.update_status(task['id'], 'processing')
+                with span('upload'):
+                    await self.upload(task['id'])
+                with span('db_write'):
+                    await self.update_status(task['id'], 'processing')
             except Exception as e:
                 logger.error(f"处理待处理任务失败 ID {task['id']}: {str(e)}")
                 await self.update_status(task['id'], 'error')
@@ -79,9 +86,11 @@ class PDFProcessor:
         async with self.semaphore:  # 使用信号量控制并发
             try:
                 logger.info(f"开始处理进行中任务 ID: {task['id']}")
-                result = await self.result(task['id'])
+                with span('poll_result'):
+                    result = await self.result(task['id'])
                 if result:
-                    await self.update_status(task['id'], 'downloading')
+                    with span('db_write'):
+                        await self.update_status(task['id'], 'downloading')
                 return result
             except Exception as e:
                 logger.error(f"处理进行中任务失败 ID {task['id']}: {str(e)}")
@@ -93,8 +102,18 @@ class PDFProcessor:
         async with self.semaphore:  # 使用信号量控制并发
             try:
                 logger.info(f"开始处理下载任务 ID: {task['id']}")
-                await self.download(task['id'])
-                await self.update_status(task['id'], 'completed')
+                with span('download'):
+                    await self.download(task['id'])
+                if self.fill_pages_enabled:
+                    try:
+                        with span('fill_pages'):
+                            filled = await self.fill_pages(task['id'])
+                        logger.info(f"已用PDF识别结果回填 {filled} 个页面 ID: {task['id']}")
+                    except Exception as e:
+                        # 回填失败不影响PDF任务，页面会由页面任务重新识别
+                        logger.warning(f"回填页面失败 ID {task['id']}: {str(e)}")
+                with span('db_write'):
+                    await self.update_status(task['id'], 'completed')
                 logger.info(f"任务处理完成 ID: {task['id']}")
             except Exception as e:
                 logger.error(f"处理下载任务失败 ID {task['id']}: {str(e)}")
@@ -111,6 +130,29 @@ class PDFProcessor:
                 )
                 await conn.commit()
                 
+    async def claim_task(self, task_id: int) -> bool:
+        """认领待处理任务，只有一个进程能把任务从 pending 改为 processing"""
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                claimed = await cursor.execute(
+                    f"UPDATE {self.task_table} SET status = 'processing', updated_at = NOW() "
+                    f"WHERE id = %s AND status = 'pending'",
+                    (task_id,)
+                )
+                await conn.commit()
+                return claimed == 1
+
+    async def touch_task(self, task_id: int):
+        """刷新处理中任务的更新时间，避免长时间轮询的任务被当作超时任务重置"""
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    f"UPDATE {self.task_table} SET updated_at = NOW() "
+                    f"WHERE id = %s AND status = 'processing'",
+                    (task_id,)
+                )
+                await conn.commit()
+
     async def reset_stale_tasks(self, timeout_minutes: int = 30):
         """重置超时的处理中任务"""
         async with self.pool.acquire() as conn:
@@ -144,6 +186,10 @@ class PDFProcessor:
         file = await self.get_pdf_file(task_id)
         if not file:
             raise Exception("文件不存在")
+
+        # 中断后重新处理的任务可能已经识别完成，直接进入下载
+        if file['task_status'] == 'success':
+            return True
             
         if file['task_id'] and file['task_status'] != 'success':
             result = await self.umi_ocr.result(file['task_id'])
@@ -178,15 +224,86 @@ class PDFProcessor:
                 logger.error(f"文件下载失败 ID {task_id}: {str(e)}")
                 raise
 
-    async def get_pdf_file(self, task_id: int) -> dict:
-        """获取PDF文件信息"""
+    async def fill_pages(self, task_id: int) -> int:
+        """把PDF逐页识别结果按页序写入同一文档的 ww_document_pages，返回回填的页数
+
+        页面按 id 顺序与PDF页码一一对应，页数不一致时不回填；
+        只写入尚未识别的页面。
+        """
+        file = await self.get_pdf_file(task_id)
+        if not file or not file['document_id']:
+            return 0
+
+        result = await self.umi_ocr.download(file['task_id'], ['jsonl'])
+        if result['code'] != 100:
+            raise Exception(result['data'])
+        content = await self.umi_ocr.get_file_content(result['data'])
+        if not content:
+            raise Exception('下载JSONL文件失败')
+        task_result = json.loads(file['task_result']) if file.get('task_result') else {}
+        texts = self.parse_page_texts(content, task_result.get('pages_count'))
+
         async with self.pool.acquire() as conn:
-            async with conn.cursor(aiomysql.DictCursor) as cursor:
+            async with conn.cursor() as cursor:
                 await cursor.execute(
-                    f"SELECT * FROM ww_pdf_file WHERE id = %s",
-                    (task_id,)
+                    f"SELECT id FROM {self.task_page} "
+                    f"WHERE document_id = %s AND deleted_at IS NULL "
+                    f"ORDER BY id ASC",
+                    (file['document_id'],)
                 )
-                return await cursor.fetchone()
+                page_ids = [row[0] for row in await cursor.fetchall()]
+                if len(page_ids) != len(texts):
+                    logger.warning(
+                        f"文档 {file['document_id']} 页面数 {len(page_ids)} 与PDF页数 {len(texts)} 不一致，跳过回填"
+                    )
+                    return 0
+
+                filled = 0
+                for page_id, text in zip(page_ids, texts):
+                    if text is None:
+                        continue
+                    filled += await cursor.execute(
+                        f"UPDATE {self.task_page} SET content = %s WHERE id = %s AND content IS NULL",
+                        (text, page_id)
+                    )
+                await conn.commit()
+        return filled
+
+    @staticmethod
+    def parse_page_texts(content: str, pages_count: int = None) -> list:
+        """解析 Umi-OCR 导出的 jsonl，按页码返回每页文本
+
+        code 101 表示该页没有文字，返回空字符串；识别失败或导出中缺失的页返回 None，
+        这些页不回填，留给页面任务重新识别。pages_count 为PDF总页数，缺省时取最大页码。
+        """
+        pages = {}
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'page' not in record:
+                continue
+            if record.get('code') == 100:
+                pages[record['page']] = ''.join(
+                    block.get('text', '') + block.get('end', '\n') for block in record.get('data') or []
+                ).strip()
+            elif record.get('code') == 101:
+                pages[record['page']] = ''
+            else:
+                pages[record['page']] = None
+        pages_count = pages_count or max(pages, default=0)
+        return [pages.get(page) for page in range(1, pages_count + 1)]
+
+    async def get_pdf_file(self, task_id: int) -> dict:
+        """获取PDF文件信息"""
+        with span('db_fetch'):
+            async with self.pool.acquire() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    await cursor.execute(
+                        f"SELECT * FROM ww_pdf_file WHERE id = %s",
+                        (task_id,)
+                    )
+                    return await cursor.fetchone()
 
     async def update_pdf_file_task_id(self, file_id: int, task_id: str):
         """更新PDF文件任务ID"""
@@ -230,7 +347,9 @@ class PDFProcessor:
             if result['code'] == 100:
                 #PATH
                 file_path = f"{file['origin_path']}.layered.pdf"
-                if await self.umi_ocr.save_file(result['data'], file_path):
+                with span('save_file'):
+                    saved = await self.umi_ocr.save_file(result['data'], file_path)
+                if saved:
                     await self.update_pdf_file_target_path(file, file_path)
                 else:
                     await self.update_pdf_file_task_error(file['id'], '下载文件失败')
@@ -247,7 +366,8 @@ class PDFProcessor:
                 
             result = await self.umi_ocr.download(file['task_id'], ['txt'])
             if result['code'] == 100:
-                txt = await self.umi_ocr.get_file_content(result['data'])
+                with span('get_file_content'):
+                    txt = await self.umi_ocr.get_file_content(result['data'])
                 if txt:
                     await self.update_pdf_file_target_txt(file['id'], txt)
                 else:
@@ -4,6 +4,7 @@ import logging
 from pathlib import Path
 import aiohttp
 import aiofiles
+from tracing import span
 
 logger = logging.getLogger('UmiOcr')
 
@@ -36,8 +37,9 @@ class UmiOcr:
                 data = aiohttp.FormData()
                 data.add_field('file', f)
                 
-                async with self.client.post(url, data=data) as resp:
-                    result = await resp.json()
+                with span('umi_upload'):
+                    async with self.client.post(url, data=data) as resp:
+                        result = await resp.json()
                     logger.info(f"文件上传成功: {file_path}")
                     return result
         except aiohttp.ClientError as e:
@@ -58,10 +60,11 @@ class UmiOcr:
         }
         
         try:
-            async with self.client.post(url, json=payload) as resp:
-                result = await resp.json()
-                logger.info(f"获取任务状态成功: {task_id}")
-                return result
+            with span('umi_result'):
+                async with self.client.post(url, json=payload) as resp:
+                    result = await resp.json()
+                    logger.info(f"获取任务状态成功: {task_id}")
+                    return result
         except aiohttp.ClientError as e:
             logger.error(f"获取任务状态请求失败: {str(e)}")
             return {'code': 500, 'data': f'获取任务状态请求失败: {str(e)}'}
@@ -78,11 +81,12 @@ class UmiOcr:
         }
         
         try:
-            async with self.client.post(url, json=payload) as resp:
-                result = await resp.json()
-                logger.info(f"获取下载链接成功: {task_id}")
-                logger.info(result)
-                return result
+            with span('umi_download'):
+                async with self.client.post(url, json=payload) as resp:
+                    result = await resp.json()
+                    logger.info(f"获取下载链接成功: {task_id}")
+                    logger.info(result)
+                    return result
         except aiohttp.ClientError as e:
             logger.error(f"获取下载链接请求失败: {str(e)}")
             return {'code': 500, 'data': f'获取下载链接请求失败: {str(e)}'}
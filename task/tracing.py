@@ -0,0 +1,215 @@
+import asyncio
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import yaml
+
+logger = logging.getLogger('Tracing')
+
+# 当前协程所属任务的上下文字段（task_id、kind 等），由 bind() 设置，span 自动带上
+_context = contextvars.ContextVar('trace_context', default={})
+
+
+class Tracer:
+    """把耗时分段以 JSONL 写入追踪文件
+
+    写文件在后台线程完成，不阻塞事件循环；未启用时 span 只做一次判断。
+    """
+
+    def __init__(self):
+        config_path = os.path.join(os.path.dirname(__file__), 'config.yml')
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f)
+
+        self.config = config.get('trace', {}) or {}
+        self.enabled = self.config.get('enabled', False)
+        self.base_dir = os.path.dirname(__file__)
+        self._listener = None
+        self._trace_logger = None
+        if self.enabled:
+            self._start_writer(self._path(self.config.get('path', 'logs/trace.jsonl')))
+
+    def _path(self, path: str) -> str:
+        return path if os.path.isabs(path) else os.path.join(self.base_dir, path)
+
+    def _start_writer(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = logging.FileHandler(path, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        records = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(records, handler)
+        self._listener.start()
+
+        self._trace_logger = logging.getLogger('Tracing.spans')
+        self._trace_logger.propagate = False
+        self._trace_logger.setLevel(logging.INFO)
+        self._trace_logger.addHandler(logging.handlers.QueueHandler(records))
+
+    def emit(self, record: dict):
+        if self.enabled:
+            self._trace_logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def close(self):
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+
+
+_tracer = None
+
+
+def get_tracer() -> Tracer:
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+@contextmanager
+def bind(**fields):
+    """为当前协程及其子任务设置追踪字段，如 bind(kind='pdf', task_id=1)"""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+@contextmanager
+def span(stage: str, **fields):
+    """记录一个阶段的耗时，同步和异步代码中都用 with span('stage') 包裹"""
+    tracer = get_tracer()
+    if not tracer.enabled:
+        yield
+        return
+
+    started_at = time.time()
+    start = time.perf_counter()
+    ok = True
+    try:
+        yield
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        tracer.emit({
+            'ts': round(started_at, 6),
+            **_context.get(),
+            'stage': stage,
+            'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+            'ok': ok,
+            **fields,
+        })
+
+
+class SamplingProfiler:
+    """按需采样事件循环线程的调用栈
+
+    收到信号后在后台线程采样 duration 秒，结果按 folded 格式（可直接生成火焰图）
+    写入 profile_dir，同时导出当时所有 asyncio 任务的调用栈。
+    """
+
+    def __init__(self, output_dir: str, interval: float = 0.005, duration: float = 30):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.duration = duration
+        self.thread_id = None
+        self._running = threading.Event()
+
+    def trigger(self):
+        """在事件循环线程中调用，开始一次采样"""
+        self.thread_id = threading.get_ident()
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._dump_tasks()
+        if self._running.is_set():
+            logger.info("采样已在进行中")
+            return
+        self._running.set()
+        threading.Thread(target=self._sample, name='SamplingProfiler', daemon=True).start()
+
+    def _output(self, suffix: str) -> str:
+        return os.path.join(
+            self.output_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.{suffix}"
+        )
+
+    def _dump_tasks(self):
+        path = self._output('tasks.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            for task in asyncio.all_tasks():
+                f.write(f"{task!r}\n")
+                task.print_stack(file=f)
+                f.write("\n")
+        logger.info(f"asyncio 任务栈已导出: {path}")
+
+    def _sample(self):
+        try:
+            stacks = Counter()
+            deadline = time.monotonic() + self.duration
+            while time.monotonic() < deadline:
+                frame = sys._current_frames().get(self.thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    stacks[';'.join(reversed(stack))] += 1
+                time.sleep(self.interval)
+
+            path = self._output('folded')
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            logger.info(f"采样结果已导出: {path}，共 {sum(stacks.values())} 个样本")
+        finally:
+            self._running.clear()
+
+
+async def monitor_loop_lag(interval: float = 0.5, threshold: float = 0.1):
+    """定时检测事件循环延迟，超过阈值时写入追踪文件并告警"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = loop.time() - start - interval
+        if lag >= threshold:
+            logger.warning(f"事件循环阻塞 {lag * 1000:.0f}ms")
+            get_tracer().emit({
+                'ts': round(time.time(), 6),
+                'stage': 'loop_lag',
+                'duration_ms': round(lag * 1000, 3),
+            })
+
+
+def install() -> list:
+    """在运行中的事件循环上安装诊断工具，返回需要随进程一起运行的后台任务
+
+    SIGUSR1 触发一次采样；启用追踪时同时启动事件循环延迟监控。
+    """
+    tracer = get_tracer()
+    loop = asyncio.get_running_loop()
+    profiler = SamplingProfiler(
+        tracer._path(tracer.config.get('profile_dir', 'logs')),
+        interval=tracer.config.get('profile_interval', 0.005),
+        duration=tracer.config.get('profile_duration', 30)
+    )
+    if hasattr(signal, 'SIGUSR1'):
+        loop.add_signal_handler(signal.SIGUSR1, profiler.trigger)
+
+    tasks = []
+    if tracer.enabled:
+        tasks.append(asyncio.create_task(monitor_loop_lag(
+            tracer.config.get('loop_lag_interval', 0.5),
+            tracer.config.get('loop_lag_threshold', 0.1)
+        )))
+    return tasks